@@ -1,9 +1,19 @@
 from flask import Flask, render_template, request, jsonify
+import numpy as np
 import pandas as pd
 import os
-from itertools import combinations
-
-from scripts.normalizer import normalizar_pipeline
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from scripts.normalizer import (
+    _codes,
+    dependents_of,
+    detect_tables,
+    normalizar_pipeline,
+    proper_subsets,
+)
 from scripts.sql_utils import (
     connect_sql_server,
     get_table_structure_df,
@@ -12,104 +22,246 @@ from scripts.sql_utils import (
     list_tables_grouped,
     safe_connect_autodetect,
 )
-import pyodbc
 
 # IMPORTANTE: tu carpeta es "Templates" con T mayúscula
 app = Flask(__name__, template_folder="Templates")
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Filas máximas que se traen de SQL Server para analizar (None = tabla completa).
+# Opt-in: con muestra, las dependencias halladas podrían no valer en la tabla entera
+app.config['SQL_SAMPLE_ROWS'] = None
 
 
 # ---------- Utilidades ----------
-def proper_subsets(pk_cols):
-    for r in range(1, len(pk_cols)):
-        for combo in combinations(pk_cols, r):
-            yield list(combo)
+# Separadores que delatan un valor no atómico; regex y tabla de translate salen
+# de la misma cadena para que el camino vectorial y el escalar no diverjan
+SEPARADORES = ",;/|[]"
+NON_ATOMIC_RE = re.compile(f"[{re.escape(SEPARADORES)}]")
+_SEP_DELETE = str.maketrans("", "", SEPARADORES)
+# Filas que se muestran de cada tabla en la página
+PREVIEW_ROWS = 200
+
+def leer_csv(path):
+    """
+    Lee un CSV a DataFrame con pd.read_csv (encabezados duplicados como a/a.1,
+    filas cortas con NaN, sin inferir fechas).
+    """
+    # memory_map evita la copia intermedia del archivo subido
+    return pd.read_csv(path, memory_map=True)
+
+# Caché LRU en memoria del contexto ya renderizado (solo texto/HTML, no DataFrames)
+_CACHE_MAX = 16
+_CACHE_LOCK = threading.Lock()
+_ANALISIS_CACHE: OrderedDict = OrderedDict()   # (digest_estructura, digest_datos) -> contexto
+
+def _cache_get(cache, key):
+    with _CACHE_LOCK:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
+
+def _cache_put(cache, key, value):
+    with _CACHE_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > _CACHE_MAX:
+            cache.popitem(last=False)
+
+def cargar_csv_subido(file_storage):
+    """
+    Guarda el CSV subido y lo parsea. Devuelve (df, digest); el digest del contenido
+    es la clave de _ANALISIS_CACHE.
+    """
+    p = os.path.join(app.config['UPLOAD_FOLDER'], file_storage.filename)
+    file_storage.save(p)
+    # El digest se calcula leyendo el archivo guardado por bloques (sin cargarlo entero)
+    h = hashlib.blake2b(digest_size=16)
+    with open(p, 'rb') as fh:
+        for bloque in iter(lambda: fh.read(1 << 20), b''):
+            h.update(bloque)
+    return leer_csv(p), h.hexdigest()
 
 def es_valor_atomico(valor):
-    if pd.isna(valor):
-        return True
-    if isinstance(valor, str) and any(sep in valor for sep in [",", ";", "/", "|", "[", "]"]):
-        return False
-    return True
+    # Camino por valor de verificar_1FN para columnas object que no son solo texto
+    # (Decimal, date, bytes o mezclas), donde .str no se puede usar.
+    # Nulos y no-texto son atómicos; el isinstance va primero y evita pd.isna por celda.
+    # translate borra los separadores en una sola pasada C; si cambia la longitud, había alguno
+    return not isinstance(valor, str) or len(valor.translate(_SEP_DELETE)) == len(valor)
+
+def tabla_html(df: pd.DataFrame, classes: str, max_rows: int = PREVIEW_ROWS) -> str:
+    """
+    Renderiza solo las primeras 'max_rows' filas; serializar el DataFrame completo
+    dominaba el tiempo de respuesta (y el tamaño del DOM) con archivos grandes.
+    """
+    html = df.head(max_rows).to_html(classes=classes, index=False)
+    if len(df) > max_rows:
+        html += f'<p class="text-muted small mb-0">Mostrando las primeras {max_rows} de {len(df)} filas.</p>'
+    return html
+
+def columnas_codificables(df: pd.DataFrame, codes: dict) -> list:
+    """
+    Columnas de 'df' que pueden participar en una DF (valores hasheables). De paso
+    deja sus códigos en 'codes' (caché de normalizer) para 2FN y 3FN.
+    """
+    cols = []
+    for c in df.columns:
+        try:
+            _codes(df, c, codes)
+        except TypeError:
+            continue  # valores no hasheables: la columna no puede participar en una DF
+        cols.append(c)
+    return cols
 
 def verificar_1FN(df: pd.DataFrame):
     for col in df.columns:
-        for val in df[col]:
-            if not es_valor_atomico(val):
-                return False, col, val
+        s = df[col]
+        # numéricas/fechas son atómicas por construcción
+        if not pd.api.types.is_string_dtype(s.dtype):
+            continue
+        if isinstance(s.dtype, pd.StringDtype) or pd.api.types.infer_dtype(s, skipna=True) == "string":
+            # na=False ya descarta los nulos dentro del mismo barrido (sin pd.isna por celda);
+            # se baja a un buffer NumPy bool para operar sin alinear índices
+            mask = s.str.contains(NON_ATOMIC_RE, na=False).to_numpy(dtype=bool)
+        else:
+            # object con valores no-texto (Decimal, date, bytes, mezclas): .str no aplica,
+            # se revisa valor a valor como antes
+            mask = ~s.map(es_valor_atomico).to_numpy(dtype=bool)
+        if mask.any():
+            # argmax devuelve la primera posición True sin materializar el subconjunto
+            return False, col, s.iat[int(np.argmax(mask))]
     return True, None, None
 
-def verificar_2FN(estructura_df: pd.DataFrame, datos_df: pd.DataFrame):
+def verificar_2FN(
+    estructura_df: pd.DataFrame,
+    datos_df: pd.DataFrame,
+    tablas_meta: dict | None = None,
+    codes: dict | None = None,
+):
     mensajes = []
-    estructura_df = estructura_df.copy()
-    estructura_df['llave'] = estructura_df.get('llave', pd.Series([""] * len(estructura_df))).astype(str)
-
-    for tabla, chunk in estructura_df.groupby('tabla'):
-        pk = chunk[chunk['llave'].str.contains('PK', case=False, na=False)]['atributo'].tolist()
+    # tablas_meta = detect_tables(estructura_df); se acepta precalculado para no re-parsear
+    if tablas_meta is None:
+        tablas_meta = detect_tables(estructura_df)
+    # codes: caché col → códigos compartida con 3FN
+    if codes is None:
+        codes = {}
+    codificables = set(columnas_codificables(datos_df, codes))
+
+    for tabla, meta in tablas_meta.items():
+        pk = meta['pk']
         if len(pk) < 2:
             continue
-        attrs_tabla = [a for a in chunk['atributo'] if a in datos_df.columns]
+        attrs_tabla = [a for a in meta['attrs'] if a in codificables]
         if not attrs_tabla:
             continue
-        df_t = datos_df[attrs_tabla].copy()
+        pk_set = set(pk)
+        candidatos = [c for c in attrs_tabla if c not in pk_set]
+        # proper_subsets va de menor a mayor tamaño: basta con reportar el subconjunto
+        # mínimo de cada atributo, los superconjuntos también lo determinan.
+        resueltos = set()
         for sub in proper_subsets(pk):
-            candidatos = [c for c in attrs_tabla if c not in pk]
-            for col in candidatos:
-                try:
-                    g = df_t.groupby(sub)[col].nunique(dropna=True)
-                except Exception:
-                    continue
-                if g.index.nunique() >= 2 and g.max() == 1:
-                    mensajes.append(
-                        f"❌ '{col}' depende solo de parte de la clave compuesta {sub} en la tabla '{tabla}'"
-                    )
+            pendientes = [c for c in candidatos if c not in resueltos]
+            if not pendientes:
+                break
+            if any(c not in codificables for c in sub):
+                continue
+            for col in dependents_of(datos_df, sub, pendientes, codes, soporte="grupos"):
+                mensajes.append(
+                    f"❌ '{col}' depende solo de parte de la clave compuesta {sub} en la tabla '{tabla}'"
+                )
+                resueltos.add(col)
     if not mensajes:
         mensajes.append("✅ Los datos cumplen con la Segunda Forma Normal (2FN).")
     return mensajes
 
-def verificar_3FN(datos_df: pd.DataFrame, estructura_df: pd.DataFrame | None = None):
-    pk = set()
-    if estructura_df is not None and 'llave' in estructura_df.columns:
-        pk = set(
-            estructura_df[estructura_df['llave'].astype(str).str.contains('PK', case=False, na=False)]['atributo'].tolist()
-        )
-    cols = [c for c in datos_df.columns if c != "__tabla"]
-    non_keys = [c for c in cols if c not in pk]
+def verificar_3FN(
+    datos_df: pd.DataFrame,
+    estructura_df: pd.DataFrame | None = None,
+    tablas_meta: dict | None = None,
+    codes: dict | None = None,
+):
+    if tablas_meta is None and estructura_df is not None:
+        tablas_meta = detect_tables(estructura_df)
+    pk = frozenset().union(*(meta['pk'] for meta in (tablas_meta or {}).values()))
+    if codes is None:
+        codes = {}
+    non_keys = [c for c in columnas_codificables(datos_df, codes) if c != "__tabla" and c not in pk]
     mensajes = []
     for det in non_keys:
-        counts = datos_df[det].value_counts(dropna=True)
-        if counts.empty or counts.max() < 2:
-            continue
-        for target in non_keys:
-            if target == det:
-                continue
-            try:
-                g = datos_df.groupby(det)[target].nunique(dropna=True)
-            except Exception:
-                continue
-            if g.max() == 1:
-                mensajes.append(f"❌ Existe una dependencia transitoria: '{target}' depende de '{det}'")
+        for target in dependents_of(datos_df, [det], non_keys, codes, soporte="repetido"):
+            mensajes.append(f"❌ Existe una dependencia transitoria: '{target}' depende de '{det}'")
     if not mensajes:
         mensajes.append("✅ Los datos cumplen con la Tercera Forma Normal (3FN).")
     return mensajes
 
 
+# ---------- Análisis ----------
+def analizar_datos(estructura_df: pd.DataFrame | None, datos_df: pd.DataFrame):
+    """
+    Evalúa 1FN/2FN/3FN y ejecuta el pipeline de normalización.
+    Devuelve el contexto que consume la plantilla (solo texto/HTML; es lo que se cachea).
+    """
+    resultado = {
+        'resultado_1fn': None,
+        'resultado_2fn': None,
+        'resultado_3fn': None,
+        'diagram_mermaid': None,
+        'sql_script': None,
+        'descripcion': None,
+        'tablas_result_html': [],
+        'resumen_acciones': None,
+    }
+
+    # La estructura se parsea una sola vez y se comparte con 2FN, 3FN y el pipeline.
+    # Va primero: una estructura sin columnas requeridas falla antes de recorrer los datos
+    tablas_meta = detect_tables(estructura_df) if estructura_df is not None else None
+
+    ok1, col, val = verificar_1FN(datos_df)
+    resultado['resultado_1fn'] = "✅ Cumple con la Primera Forma Normal (1FN)." if ok1 else \
+                                 f"❌ No cumple con 1FN. Columna '{col}' tiene valor no atómico: '{val}'"
+    # Igual con los códigos factorizados: se hashea cada columna una sola vez para 2FN y 3FN
+    codes = {}
+    if estructura_df is not None:
+        resultado['resultado_2fn'] = verificar_2FN(estructura_df, datos_df, tablas_meta, codes)
+    resultado['resultado_3fn'] = verificar_3FN(datos_df, estructura_df, tablas_meta, codes)
+
+    # Datos muestreados en el servidor (ver fetch_table_df): cada conclusión lo dice
+    muestra = datos_df.attrs.get('muestra')
+    if muestra is not None:
+        aviso = f" (muestra de {muestra} filas)"
+        resultado['resultado_1fn'] += aviso
+        for clave in ('resultado_2fn', 'resultado_3fn'):
+            if resultado[clave]:
+                resultado[clave] = [m + aviso for m in resultado[clave]]
+
+    if estructura_df is not None:
+        (
+            _schema_final,
+            tablas_data,
+            resultado['diagram_mermaid'],
+            resultado['sql_script'],
+            resultado['descripcion'],
+            resultado['resumen_acciones'],
+        ) = normalizar_pipeline(estructura_df, datos_df, base_tables=tablas_meta)
+
+        for name, df in tablas_data.items():
+            resultado['tablas_result_html'].append((
+                name,
+                tabla_html(df, 'table table-sm table-striped', max_rows=50)
+            ))
+    return resultado
+
+
 # ---------- Home ----------
 @app.route('/', methods=['GET', 'POST'])
 def index():
     try:
         estructura_df = None
         datos_df = None
-        resultado_1fn = None
-        resultado_2fn = None
-        resultado_3fn = None
-        diagram_mermaid = None
-        sql_script = None
-        descripcion = None
-        tablas_result_html = []
-        resumen_acciones = None
+        digest_estructura = None
+        digest_datos = None
+        resultados = {}
 
         if request.method == 'POST':
             source = request.form.get('source', 'csv')
@@ -118,13 +270,9 @@ def index():
                 estructura_file = request.files.get('estructura')
                 datos_file = request.files.get('datos')
                 if estructura_file and estructura_file.filename.lower().endswith('.csv'):
-                    p = os.path.join(app.config['UPLOAD_FOLDER'], estructura_file.filename)
-                    estructura_file.save(p)
-                    estructura_df = pd.read_csv(p)
+                    estructura_df, digest_estructura = cargar_csv_subido(estructura_file)
                 if datos_file and datos_file.filename.lower().endswith('.csv'):
-                    p = os.path.join(app.config['UPLOAD_FOLDER'], datos_file.filename)
-                    datos_file.save(p)
-                    datos_df = pd.read_csv(p)
+                    datos_df, digest_datos = cargar_csv_subido(datos_file)
 
             elif source == 'sql':
                 # CONEXIÓN 100% AUTOMÁTICA (sin servidor en UI)
@@ -140,7 +288,10 @@ def index():
                     if not (database and table):
                         raise ValueError("Selecciona Base de datos y Tabla.")
 
-                    datos_df = fetch_table_df(conn, schema_name, table)
+                    datos_df = fetch_table_df(
+                        conn, schema_name, table,
+                        sample_rows=app.config.get('SQL_SAMPLE_ROWS'),
+                    )
                     estructura_df = get_table_structure_df(conn, schema_name, table)
                 finally:
                     try:
@@ -150,41 +301,21 @@ def index():
 
         # ----- Evaluación + pipeline -----
         if datos_df is not None:
-            ok1, col, val = verificar_1FN(datos_df)
-            resultado_1fn = "✅ Cumple con la Primera Forma Normal (1FN)." if ok1 else \
-                            f"❌ No cumple con 1FN. Columna '{col}' tiene valor no atómico: '{val}'"
-            if estructura_df is not None:
-                resultado_2fn = verificar_2FN(estructura_df, datos_df)
-            resultado_3fn = verificar_3FN(datos_df, estructura_df)
-
-            if estructura_df is not None:
-                (
-                    schema_final,
-                    tablas_data,
-                    diagram_mermaid,
-                    sql_script,
-                    descripcion,
-                    resumen_acciones,
-                ) = normalizar_pipeline(estructura_df, datos_df)
-
-                for name, df in tablas_data.items():
-                    tablas_result_html.append((
-                        name,
-                        df.head(50).to_html(classes='table table-sm table-striped', index=False)
-                    ))
+            # Solo los CSV tienen digest; los datos de SQL Server pueden cambiar entre peticiones
+            clave = (digest_estructura, digest_datos) if digest_datos else None
+            cacheado = _cache_get(_ANALISIS_CACHE, clave) if clave else None
+            if cacheado is not None:
+                resultados = cacheado
+            else:
+                resultados = analizar_datos(estructura_df, datos_df)
+                if clave:
+                    _cache_put(_ANALISIS_CACHE, clave, resultados)
 
         return render_template(
             'index.html',
-            estructura=estructura_df.to_html(classes='table table-bordered', index=False) if estructura_df is not None else None,
-            datos=datos_df.to_html(classes='table table-striped', index=False) if datos_df is not None else None,
-            resultado_1fn=resultado_1fn,
-            resultado_2fn=resultado_2fn,
-            resultado_3fn=resultado_3fn,
-            diagram_mermaid=diagram_mermaid,
-            sql_script=sql_script,
-            descripcion=descripcion,
-            tablas_result_html=tablas_result_html,
-            resumen_acciones=resumen_acciones
+            estructura=tabla_html(estructura_df, 'table table-bordered') if estructura_df is not None else None,
+            datos=tabla_html(datos_df, 'table table-striped') if datos_df is not None else None,
+            **resultados
         )
     except Exception as e:
         app.logger.exception("Error en '/'")
@@ -241,7 +372,6 @@ def api_sql_tables():
 
 if __name__ == '__main__':
     import webbrowser
-    import threading
 
     def open_browser():
         webbrowser.open("http://127.0.0.1:5000")
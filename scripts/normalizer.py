@@ -1,9 +1,30 @@
 # scripts/normalizer.py
+import numpy as np
 import pandas as pd
 import re
 from itertools import combinations
 
 MULTI_SEPARATORS = [",", ";", "/", "|"]
+# Tipo SQL por defecto para atributos sin tipo declarado (o no reconocido)
+DEFAULT_SQL_TYPE = "NVARCHAR(255)"
+# Columnas que toda estructura debe traer (tipo y llave son opcionales)
+ESTRUCTURA_REQUIRED_COLS = ("tabla", "atributo")
+
+# Patrones compilados una vez (se usan por celda / por fila de estructura)
+_BRACKETS_RE = re.compile(r"^[\[\(\{]\s*|\s*[\]\)\}]$")
+_FK_RE = re.compile(r'FK\s*:?\s*([A-Za-z0-9_\.]+)\s*\(\s*([A-Za-z0-9_]+)\s*\)')
+_UNSAFE_ID_RE = re.compile(r'[^A-Za-z0-9_]')
+# Familia de tipo SQL (ver _type_family): INT, luego DECIMAL/NUMERIC/FLOAT/REAL/MONEY,
+# luego DATE/TIME, luego BIT/BOOL; el grupo que casa da el nombre de la familia
+_TYPE_FAMILY_RE = re.compile(
+    r"(?:(?=.*INT)(?P<int>)"
+    r"|(?=.*(?:DECIMAL|NUMERIC|FLOAT|REAL|MONEY))(?P<float>)"
+    r"|(?=.*(?:DATE|TIME))(?P<date>)"
+    r"|(?=.*(?:BIT|BOOL))(?P<boolean>))",
+    re.DOTALL,
+)
+# Tabla de borrado de separadores: si translate no acorta el texto, no hay ninguno
+_SEP_DELETE = str.maketrans("", "", "".join(MULTI_SEPARATORS))
 
 
 def _clean_value(v):
@@ -11,7 +32,7 @@ def _clean_value(v):
         return None
     if isinstance(v, str):
         v = v.strip()
-        v = re.sub(r"^[\[\(\{]\s*|\s*[\]\)\}]$", "", v)  # quita [] () {}
+        v = _BRACKETS_RE.sub("", v)  # quita [] () {}
         return v if v != "" else None
     return v
 
@@ -25,6 +46,8 @@ def split_multivalue(value):
     raw = _clean_value(value)
     if raw is None:
         return []
+    if len(raw.translate(_SEP_DELETE)) == len(raw):
+        return [raw]
     for sep in MULTI_SEPARATORS:
         if sep in raw:
             parts = [p.strip() for p in raw.split(sep)]
@@ -34,43 +57,180 @@ def split_multivalue(value):
     return [raw]
 
 
+def _clean_series(s: pd.Series) -> pd.Series:
+    """_clean_value sobre una Serie de strings: strip + quitar [] () {} de los extremos; "" → None."""
+    # El patrón como texto (no compilado) deja que pandas use el motor nativo de str
+    s = s.astype("str").str.strip().str.replace(_BRACKETS_RE.pattern, "", regex=True)
+    return s.astype(object).where(s != "", None)
+
+
+def _explode_multivalue(s: pd.Series):
+    """
+    split_multivalue aplicado a una columna completa con operaciones .str.
+    Devuelve una Serie indexada por POSICIÓN de fila con un elemento por valor
+    resultante (ya pasado por _clean_value), en el mismo orden que el bucle por
+    filas; las filas nulas o vacías no aportan elementos. Devuelve None si la
+    columna trae valores que split_multivalue no admite (p. ej. listas).
+    """
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    s = s.reset_index(drop=True)
+    if s.dtype != object and not pd.api.types.is_string_dtype(s.dtype):
+        # numéricas/fechas: un valor por fila no nula, sin tocar
+        return s[s.notna()]
+
+    if s.dtype == object:
+        es_str = s.map(lambda x: isinstance(x, str)).to_numpy(dtype=bool)
+        otros = s[~es_str]
+        try:
+            nulos = np.array([bool(pd.isna(x)) for x in otros], dtype=bool)
+        except Exception:
+            return None
+        otros = otros[~nulos]
+    else:
+        es_str = s.notna().to_numpy(dtype=bool)
+        otros = s.iloc[:0]
+
+    # Primera limpieza (la de split_multivalue); los vacíos no generan filas
+    pendientes = _clean_series(s[es_str]).dropna().astype("str")
+    trozos = []
+    # Como split_multivalue: manda el PRIMER separador que produce más de un valor
+    for sep in MULTI_SEPARATORS:
+        if pendientes.empty:
+            break
+        cand = pendientes[pendientes.str.contains(sep, regex=False)]
+        if cand.empty:
+            continue
+        partes = cand.str.split(sep, regex=False).explode().str.strip()
+        partes = partes[partes != ""]
+        n = partes.groupby(level=0, sort=False).size()
+        multi = n.index[n > 1]
+        if len(multi):
+            trozos.append(partes[partes.index.isin(multi)])
+            pendientes = pendientes.drop(multi)
+    trozos.append(pendientes)
+
+    # Segunda limpieza: la que normalize_1NF aplica a cada valor separado
+    valores = _clean_series(pd.concat(trozos).astype(object))
+    return pd.concat([valores, otros.astype(object)]).sort_index(kind="stable")
+
+
 def detect_tables(estructura_df: pd.DataFrame):
     """
     Espera columnas: tabla, atributo, tipo (opcional), llave (PK, FK:Tabla(Col), vacío)
     Devuelve un dict con metadatos por tabla.
+    Si faltan 'tabla' o 'atributo' lanza ValueError de inmediato (no por fila).
     """
-    estructura_df = estructura_df.copy()
-    estructura_df["llave"] = estructura_df.get("llave", pd.Series([""] * len(estructura_df))).astype(str)
+    faltan = [c for c in ESTRUCTURA_REQUIRED_COLS if c not in estructura_df.columns]
+    if faltan:
+        raise ValueError(f"La estructura no tiene las columnas requeridas: {', '.join(faltan)}")
+
+    # Sin copiar 'estructura_df': solo se lee; los roles van a un frame aparte
+    llave = estructura_df.get("llave", pd.Series([""] * len(estructura_df), index=estructura_df.index)).astype(str)
+
+    # Roles (PK / FK) de toda la estructura en una sola pasada, antes de agrupar por tabla.
+    # Formatos FK: "FK:Clientes(idCliente)" o "FK Clientes(idCliente)"
+    fk_ref = llave.str.extract(_FK_RE)
+    roles = pd.DataFrame({
+        'tabla': estructura_df['tabla'],
+        'atributo': estructura_df['atributo'],
+        # Tipo por defecto resuelto una vez para toda la estructura, no por tabla
+        'tipo': (estructura_df["tipo"].fillna(DEFAULT_SQL_TYPE)
+                 if "tipo" in estructura_df.columns else DEFAULT_SQL_TYPE),
+        # PK sin regex: mayúsculas una vez + búsqueda literal (case=False obliga al motor de regex)
+        '__es_pk': llave.str.upper().str.contains('PK', regex=False, na=False),
+        '__fk_tabla': fk_ref[0],
+        '__fk_col': fk_ref[1],
+    })
 
     tables = {}
-    for t, chunk in estructura_df.groupby('tabla'):
+    for t, chunk in roles.groupby('tabla'):
         attrs = chunk['atributo'].tolist()
-        tipos = dict(zip(
-            chunk['atributo'],
-            chunk.get('tipo', pd.Series(["NVARCHAR(255)"] * len(chunk))).fillna('NVARCHAR(255)')
-        ))
-        pks = chunk[chunk['llave'].str.contains('PK', case=False, na=False)]['atributo'].tolist()
-
-        fks_map = []
-        fk_rows = chunk[chunk['llave'].str.contains('FK', case=False, na=False)]
-        for _, row in fk_rows.iterrows():
-            # Formatos: "FK:Clientes(idCliente)" o "FK Clientes(idCliente)"
-            m = re.search(r'FK\s*:?\s*([A-Za-z0-9_\.]+)\s*\(\s*([A-Za-z0-9_]+)\s*\)', str(row['llave']))
-            if m:
-                fks_map.append((row['atributo'], m.group(1), m.group(2)))
+        tipos = dict(zip(chunk['atributo'], chunk['tipo']))
+        pks = chunk.loc[chunk['__es_pk'], 'atributo'].tolist()
+        fks_map = [
+            (a, ref_t, ref_c)
+            for a, ref_t, ref_c in zip(chunk['atributo'], chunk['__fk_tabla'], chunk['__fk_col'])
+            if pd.notna(ref_t)
+        ]
 
         tables[t] = {'attrs': attrs, 'types': tipos, 'pk': pks, 'fks': fks_map}
     return tables
 
 
 def proper_subsets(pk):
-    """Subconjuntos propios no vacíos de la clave compuesta."""
-    out = []
+    """
+    Subconjuntos propios no vacíos de la clave compuesta, de menor a mayor tamaño.
+    Es un generador: quien corta antes (p. ej. verificar_2FN) no paga los 2^k - 2.
+    Cada subconjunto sale como lista (se concatena y se muestra tal cual).
+    """
     for r in range(1, len(pk)):
-        out += [list(c) for c in combinations(pk, r)]
+        for c in combinations(pk, r):
+            yield list(c)
+
+
+def _codes(df: pd.DataFrame, col, cache: dict | None = None) -> np.ndarray:
+    """
+    Códigos enteros densos de una columna (NaN → -1). Con 'cache' (dict col → códigos)
+    cada columna se factoriza una sola vez mientras las filas de 'df' no cambien.
+    """
+    if cache is None:
+        return pd.factorize(df[col], use_na_sentinel=True)[0]
+    if col not in cache:
+        cache[col] = pd.factorize(df[col], use_na_sentinel=True)[0]
+    return cache[col]
+
+
+def _group_codes(df: pd.DataFrame, cols, cache: dict | None = None) -> np.ndarray:
+    """
+    Código de grupo por fila para la combinación de 'cols' (-1 si alguna es NaN).
+    Combina los códigos de cada columna y los vuelve a densificar.
+    Con 'cache' también se memorizan las combinaciones (clave: tupla de columnas),
+    así [a, b, c] parte del grupo ya calculado para el prefijo [a, b].
+    """
+    cols = list(cols)
+    if cache is not None and len(cols) > 1:
+        key = tuple(cols)
+        if key not in cache:
+            cache[key] = _combine_codes(_group_codes(df, cols[:-1], cache),
+                                        _codes(df, cols[-1], cache))
+        return cache[key]
+    g = _codes(df, cols[0], cache)
+    for c in cols[1:]:
+        g = _combine_codes(g, _codes(df, c, cache))
+    return g
+
+
+def _combine_codes(g: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """Códigos densos del par (g, k) fila a fila; -1 si cualquiera de los dos es -1."""
+    valid = (g >= 0) & (k >= 0)
+    out = np.full(len(g), -1, dtype=np.int64)
+    if valid.any():
+        comb = g[valid].astype(np.int64) * (int(k.max()) + 1) + k[valid]
+        out[valid] = pd.factorize(comb)[0]
     return out
 
 
+def _depende(sd: np.ndarray, t: np.ndarray, soporte_en_det: bool = False) -> bool:
+    """
+    Regla de dependencia sobre códigos ya ordenados por grupo: 'sd' son los códigos
+    de grupo (válidos, contiguos) y 't' los del target en el mismo orden (-1 = nulo).
+    Ignorando nulos, ningún grupo puede tener dos valores distintos del target
+    (nunique().max() == 1) y algún grupo debe tener >= 2 filas (soporte).
+    Con soporte_en_det=True quien llama ya verificó el soporte sobre el determinante
+    (ver dependents_of) y aquí solo se exige algún valor no nulo del target.
+    """
+    con_valor = t >= 0
+    sdv, tv = sd[con_valor], t[con_valor]
+    mismo_grupo = sdv[1:] == sdv[:-1]
+    if soporte_en_det:
+        if not con_valor.any():
+            return False
+    elif sdv.size < 2 or not mismo_grupo.any():
+        return False
+    return not (mismo_grupo & (tv[1:] != tv[:-1])).any()
+
+
 def depends_on(df: pd.DataFrame, determinant_cols, target):
     """
     Heurística: target depende funcionalmente de determinant_cols si, ignorando NaNs,
@@ -81,22 +241,79 @@ def depends_on(df: pd.DataFrame, determinant_cols, target):
     if any(col not in df.columns for col in needed):
         return False
 
-    # Filtra filas con NaN en determinantes o target
-    df2 = df.dropna(subset=determinant_cols)
-    df2 = df2[df2[target].notna()]
-    if df2.empty:
-        return False
+    # Filas con NaN en determinantes o target quedan fuera (código -1)
+    g = _group_codes(df, determinant_cols)
+    valid = g >= 0
+    order = np.argsort(g[valid], kind='stable')
+    return _depende(g[valid][order], _codes(df, target)[valid][order])
+
 
-    grp = df2.groupby(determinant_cols)
-    nunq = grp[target].nunique(dropna=True)
-    sizes = grp.size()
+def dependents_of(df: pd.DataFrame, determinant_cols, targets, codes: dict | None = None,
+                  soporte: str = "filas"):
+    """
+    Versión por lotes de depends_on: factoriza y ordena el determinante una sola vez
+    y evalúa cada target comparando códigos enteros vecinos (sin groupby).
+    'codes' es una caché opcional col → códigos para reutilizar entre llamadas
+    sobre las mismas filas (ver normalize_2NF / normalize_3NF).
+    'soporte' elige qué cuenta como evidencia de la dependencia:
+      - "filas": algún grupo con >= 2 filas con target no nulo (regla de depends_on);
+      - "repetido": algún valor del determinante repetido (verificar_3FN);
+      - "grupos": al menos dos grupos distintos del determinante (verificar_2FN).
+    Devuelve la lista de targets que dependen funcionalmente de determinant_cols.
+    """
+    determinant_cols = list(determinant_cols)
+    if any(col not in df.columns for col in determinant_cols):
+        return []
+    targets = [t for t in targets if t in df.columns and t not in determinant_cols]
+    if not targets:
+        return []
+
+    g = _group_codes(df, determinant_cols, codes)
+    valid = g >= 0
+    gv = g[valid]
+    if soporte != "filas":
+        # Poda sobre el determinante: los códigos son densos (0..k-1), así que
+        # bincount cuenta en O(n) sin ordenar
+        if gv.size < 2:
+            return []
+        cuentas = np.bincount(gv)
+        if (cuentas.max() if soporte == "repetido" else cuentas.size) < 2:
+            return []
+    # Un solo ordenamiento por determinante deja cada grupo contiguo para todos los targets
+    order = np.argsort(gv, kind='stable')
+    sd = gv[order]
+    return [
+        t for t in targets
+        if _depende(sd, _codes(df, t, codes)[valid][order], soporte_en_det=soporte != "filas")
+    ]
+
+
+def _table_meta(attrs, source_types, pk, fks=()):
+    """
+    Metadatos de una tabla del esquema ({'attrs', 'types', 'pk', 'fks'}) con el tipo
+    de cada atributo tomado de 'source_types' (DEFAULT_SQL_TYPE si no está).
+    Único punto donde se arma esta forma para 1FN/2FN/3FN.
+    """
+    attrs = list(attrs)
+    return {
+        'attrs': attrs,
+        'types': {c: source_types.get(c, DEFAULT_SQL_TYPE) for c in attrs},
+        'pk': list(pk),
+        'fks': list(fks),
+    }
 
-    # Condición de dependencia (cada grupo tiene un único target)
-    unique_per_group = (nunq.max() == 1)
-    # Soporte: existe al menos un grupo con tamaño >= 2 (evita "depende" por datos escasos)
-    has_support = (sizes.max() >= 2)
 
-    return bool(unique_per_group and has_support)
+def _drop_empty_and_dupes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Equivale a df.dropna(how="all").drop_duplicates() con una sola selección:
+    las dos máscaras se combinan y se copia el frame una vez en lugar de dos.
+    Una fila vacía nunca es la primera aparición de una fila con datos, así
+    que duplicated() sobre el frame completo da el mismo resultado.
+    """
+    if df.shape[1] == 0:
+        return df.dropna(how="all").drop_duplicates()
+    keep = df.notna().any(axis=1).to_numpy() & ~df.duplicated().to_numpy()
+    return df[keep]
 
 
 def normalize_1NF(table_name, meta, df):
@@ -109,53 +326,52 @@ def normalize_1NF(table_name, meta, df):
     schema = {}
 
     base_cols = [c for c in meta['attrs'] if c in df.columns]
-    base_df = df[base_cols].copy()
+    base_df = df[base_cols]
     # NO mezclar basura: elimina filas completamente vacías en el subset de columnas
     base_df = base_df.dropna(how="all")
 
-    # Detectar multivaluados
+    # Detectar multivaluados: una columna lo es si alguna fila aporta más de un valor
+    # (posición repetida en la Serie expandida)
     multival_cols = []
+    partes_por_col = {}
     for col in base_cols:
-        try:
-            if base_df[col].apply(lambda x: len(split_multivalue(x))).max() > 1:
-                multival_cols.append(col)
-        except Exception:
+        partes = _explode_multivalue(base_df[col])
+        if partes is None:
             # Columnas no-string con tipos raros: ignora
-            pass
+            continue
+        if partes.index.has_duplicates:
+            multival_cols.append(col)
+            partes_por_col[col] = partes
 
-    # Construye tablas hijas
+    # Construye tablas hijas por columnas: cada clave se replica tomando las
+    # posiciones de fila de los valores separados (sin iterrows ni dicts por fila)
     for mv in multival_cols:
         child_name = f"{table_name}_{mv}"
         pk_cols = meta['pk'][:] if len(meta['pk']) > 0 else [f"{table_name}_id_auto"]
-        expanded_rows = []
-        for idx, r in base_df.iterrows():
-            values = split_multivalue(r[mv])
-            r = r.copy()
-            if len(meta['pk']) == 0 and f"{table_name}_id_auto" not in r:
-                r[f"{table_name}_id_auto"] = idx
-            for v in values:
-                new_row = {pk: r.get(pk) for pk in pk_cols}
-                new_row[mv] = _clean_value(v)
-                expanded_rows.append(new_row)
-        child_df = pd.DataFrame(expanded_rows).dropna(how="all").drop_duplicates()
-
-        # tipos
-        types = {}
-        for c in child_df.columns:
-            types[c] = meta['types'].get(c, 'NVARCHAR(255)')
+        partes = partes_por_col[mv]
+        pos = partes.index.to_numpy()
+        child_cols = {}
+        for pk in pk_cols:
+            if pk in base_df.columns:
+                child_cols[pk] = base_df[pk].to_numpy(dtype=object)[pos].tolist()
+            elif len(meta['pk']) == 0:
+                # sin PK declarada: el id automático es la etiqueta de la fila
+                child_cols[pk] = base_df.index[pos].tolist()
+            else:
+                child_cols[pk] = [None] * len(pos)
+        child_cols[mv] = partes.tolist()
+        child_df = _drop_empty_and_dupes(pd.DataFrame(child_cols))
 
         # PK de hija: pk base + mv
         child_pk = pk_cols + [mv]
-        schema[child_name] = {
-            'attrs': list(child_df.columns),
-            'types': types,
-            'pk': child_pk,
-            'fks': [(pk, table_name, pk) for pk in pk_cols]
-        }
+        schema[child_name] = _table_meta(
+            child_df.columns, meta['types'], child_pk,
+            [(pk, table_name, pk) for pk in pk_cols],
+        )
         result_tables[child_name] = child_df
 
     # Quitar columnas multivaluadas de la base
-    base_df = base_df.drop(columns=multival_cols, errors='ignore').dropna(how="all").drop_duplicates()
+    base_df = _drop_empty_and_dupes(base_df.drop(columns=multival_cols, errors='ignore'))
 
     # Si no había PK y se generó {tabla}_id_auto, lo trasladamos a base
     if len(meta['pk']) == 0 and f"{table_name}_id_auto" in base_df.columns:
@@ -163,12 +379,8 @@ def normalize_1NF(table_name, meta, df):
     else:
         meta_pk = meta['pk']
 
-    schema[table_name] = {
-        'attrs': list(base_df.columns),
-        'types': {c: meta['types'].get(c, 'NVARCHAR(255)') for c in base_df.columns},
-        'pk': meta_pk,
-        'fks': meta['fks'][:]  # FKs definidas en estructura
-    }
+    # FKs definidas en estructura (copia: las siguientes formas normales agregan más)
+    schema[table_name] = _table_meta(base_df.columns, meta['types'], meta_pk, meta['fks'])
     result_tables[table_name] = base_df
 
     return schema, result_tables, multival_cols
@@ -181,42 +393,41 @@ def normalize_2NF(table_name, schema, tables_data):
     tenga FK -> TABLA_DETERMINANTE (NO al revés).
     """
     meta = schema[table_name]
-    df = tables_data[table_name].copy()
+    # sin copia: df solo se reasigna
+    df = tables_data[table_name]
 
     pk = meta['pk']
     if len(pk) < 2:
         return schema, tables_data, []  # nada que hacer
 
     created = []
+    pk_set = set(pk)
+    # dependents_of ignora los candidatos que ya se movieron a otra tabla
+    candidates = [col for col in df.columns if col not in pk_set]
+    # Dentro del bucle solo se quitan columnas (no filas): los códigos siguen valiendo
+    codes = {}
+    # set paralelo a la lista de FKs: deduplicar sin recorrer la lista en cada alta
+    base_fks = schema[table_name].get('fks', [])
+    fks_vistas = set(base_fks)
     for sub in proper_subsets(pk):
-        dependents = []
-        for col in df.columns:
-            if col in pk:
-                continue
-            if depends_on(df, sub, col):
-                dependents.append(col)
+        dependents = dependents_of(df, sub, candidates, codes)
 
         if dependents:
             new_name = f"{table_name}_{'_'.join(sub)}_det"
             cols = sub + dependents
-            new_df = df[cols].drop_duplicates().copy()
+            new_df = df[cols].drop_duplicates()
 
             # esquema de la tabla determinante (sin FK hacia la base)
-            types = {c: meta['types'].get(c, 'NVARCHAR(255)') for c in cols}
-            schema[new_name] = {
-                'attrs': cols,
-                'types': types,
-                'pk': sub[:],
-                'fks': []
-            }
+            schema[new_name] = _table_meta(cols, meta['types'], sub)
             tables_data[new_name] = new_df
 
             # En la base, quitamos los dependientes y agregamos FK(sub) -> new_name(sub)
             df = df.drop(columns=dependents, errors='ignore')
-            base_fks = schema[table_name].get('fks', [])
             for s in sub:
-                if (s, new_name, s) not in base_fks:
-                    base_fks.append((s, new_name, s))
+                fk = (s, new_name, s)
+                if fk not in fks_vistas:
+                    fks_vistas.add(fk)
+                    base_fks.append(fk)
             schema[table_name]['fks'] = base_fks
 
             created.append((new_name, sub, dependents))
@@ -226,7 +437,7 @@ def normalize_2NF(table_name, schema, tables_data):
     tables_data[table_name] = df
     schema[table_name]['attrs'] = list(df.columns)
     schema[table_name]['types'] = {
-        c: schema[table_name]['types'].get(c, meta['types'].get(c, 'NVARCHAR(255)'))
+        c: schema[table_name]['types'].get(c, meta['types'].get(c, DEFAULT_SQL_TYPE))
         for c in df.columns
     }
     return schema, tables_data, created
@@ -238,43 +449,38 @@ def normalize_3NF(table_name, schema, tables_data):
     Crea tabla dimensión {tabla}_dim_{A} con PK = A y columnas dependientes.
     """
     meta = schema[table_name]
-    df = tables_data[table_name].copy()
+    # sin copia: df solo se reasigna
+    df = tables_data[table_name]
     pk = set(meta['pk'])
 
     non_keys = [c for c in df.columns if c not in pk]
     created = []
 
     used_as_det = set()  # evita crear múltiples veces para el mismo determinante
+    # Cada columna se factoriza una vez para todos los determinantes (el bucle solo quita columnas)
+    codes = {}
+    base_fks = schema[table_name].get('fks', [])
+    fks_vistas = set(base_fks)
     for det in non_keys:
         if det in used_as_det:
             continue
-        dependents = []
-        for target in non_keys:
-            if target == det:
-                continue
-            if depends_on(df, [det], target):
-                dependents.append(target)
+        dependents = dependents_of(df, [det], non_keys, codes)
 
         if dependents:
             new_name = f"{table_name}_dim_{det}"
             cols = [det] + dependents
-            new_df = df[cols].drop_duplicates().copy()
-
-            types = {c: meta['types'].get(c, 'NVARCHAR(255)') for c in cols}
-            schema[new_name] = {
-                'attrs': cols,
-                'types': types,
-                'pk': [det],
-                'fks': []
-            }
+            new_df = df[cols].drop_duplicates()
+
+            schema[new_name] = _table_meta(cols, meta['types'], [det])
             tables_data[new_name] = new_df
             created.append((new_name, det, dependents))
 
             # En la tabla base, retiramos los dependents; mantenemos 'det' como FK a la dimensión
             df = df.drop(columns=dependents, errors='ignore')
-            base_fks = schema[table_name].get('fks', [])
-            if (det, new_name, det) not in base_fks:
-                base_fks.append((det, new_name, det))
+            fk = (det, new_name, det)
+            if fk not in fks_vistas:
+                fks_vistas.add(fk)
+                base_fks.append(fk)
             schema[table_name]['fks'] = base_fks
             used_as_det.add(det)
 
@@ -282,7 +488,7 @@ def normalize_3NF(table_name, schema, tables_data):
     tables_data[table_name] = df
     schema[table_name]['attrs'] = list(df.columns)
     schema[table_name]['types'] = {
-        c: schema[table_name]['types'].get(c, meta['types'].get(c, 'NVARCHAR(255)'))
+        c: schema[table_name]['types'].get(c, meta['types'].get(c, DEFAULT_SQL_TYPE))
         for c in df.columns
     }
 
@@ -303,18 +509,24 @@ def merge_tables(base_tables, add_tables):
     return out
 
 
+def _type_family(t) -> str:
+    """
+    Familia de un tipo SQL declarado: 'int', 'float', 'date', 'boolean' o 'string'.
+    Única clasificación compartida por map_sql_type (DDL) y generate_mermaid (ER).
+    """
+    # Una sola pasada del regex; las alternativas se prueban en orden de prioridad
+    m = _TYPE_FAMILY_RE.match(str(t).upper())
+    return m.lastgroup if m else "string"
+
+
 def map_sql_type(t: str):
-    s = str(t).upper()
-    if any(x in s for x in ["INT", "BIGINT", "SMALLINT", "TINYINT"]):
-        return s
-    if any(x in s for x in ["DECIMAL", "NUMERIC", "FLOAT", "REAL", "MONEY"]):
-        return s
-    if "DATE" in s or "TIME" in s:
-        return s
-    if "BIT" in s or "BOOL" in s:
+    fam = _type_family(t)
+    if fam in ("int", "float", "date"):
+        return str(t).upper()
+    if fam == "boolean":
         return "BIT"
     # por defecto
-    return "NVARCHAR(255)"
+    return DEFAULT_SQL_TYPE
 
 
 def _safe_id(name: str) -> str:
@@ -323,8 +535,8 @@ def _safe_id(name: str) -> str:
     - Reemplaza cualquier cosa que no sea [A-Za-z0-9_] por "_"
     - Evita empezar por número anteponiendo "_"
     """
-    sid = re.sub(r'[^A-Za-z0-9_]', '_', str(name))
-    if re.match(r'^[0-9]', sid):
+    sid = _UNSAFE_ID_RE.sub('_', str(name))
+    if sid[:1].isdigit():
         sid = '_' + sid
     return sid
 
@@ -337,24 +549,20 @@ def generate_mermaid(schema):
 
     lines = ["erDiagram"]
 
-    # entidades
+    # entidades (tipo Mermaid memoizado por tipo SQL: se repiten mucho entre columnas)
+    mermaid_tipo = {}
+    append = lines.append
     for t, meta in schema.items():
         tid = idmap[t]
-        lines.append(f"  {tid} {{")
+        types_get = meta['types'].get
+        append(f"  {tid} {{")
         for col in meta['attrs']:
-            typ = meta['types'].get(col, 'NVARCHAR(255)').lower()
-            if "int" in typ:
-                mtyp = "int"
-            elif any(x in typ for x in ["decimal", "numeric", "float", "real", "money"]):
-                mtyp = "float"
-            elif "date" in typ or "time" in typ:
-                mtyp = "date"
-            elif "bit" in typ or "bool" in typ:
-                mtyp = "boolean"
-            else:
-                mtyp = "string"
-            lines.append(f"    {mtyp} {col}")
-        lines.append("  }")
+            raw = types_get(col, DEFAULT_SQL_TYPE)
+            mtyp = mermaid_tipo.get(raw)
+            if mtyp is None:
+                mtyp = mermaid_tipo[raw] = _type_family(raw)
+            append(f"    {mtyp} {col}")
+        append("  }")
 
     # relaciones
     for t, meta in schema.items():
@@ -370,29 +578,46 @@ def generate_mermaid(schema):
     return "\n".join(lines)
 
 
-def generate_sql(schema):
-    stmts = []
+def iter_sql(schema):
+    """
+    Genera el script DDL sentencia a sentencia (CREATE TABLE por tabla y luego un
+    bloque de FKs por tabla). Permite volcarlo a un archivo o respuesta sin armar
+    el texto completo en memoria; generate_sql lo une en un solo string.
+    """
+    # Los mismos tipos se repiten en muchas columnas: map_sql_type una vez por tipo distinto
+    tipo_sql = {}
     for t, meta in schema.items():
-        cols_defs = []
-        for col in meta['attrs']:
-            col_type = map_sql_type(meta['types'].get(col, 'NVARCHAR(255)'))
-            nullability = "NOT NULL" if col in meta['pk'] else "NULL"
-            cols_defs.append(f"    [{col}] {col_type} {nullability}")
         pk = meta['pk']
+        pk_set = set(pk)
+        types = meta['types']
+        attrs = meta['attrs']
+        tipos_col = [types.get(col, DEFAULT_SQL_TYPE) for col in attrs]
+        for raw in set(tipos_col).difference(tipo_sql):
+            tipo_sql[raw] = map_sql_type(raw)
+        # Definiciones de columna en una sola comprensión (sin append por columna)
+        cols_defs = [
+            f"    [{col}] {tipo_sql[raw]} {'NOT NULL' if col in pk_set else 'NULL'}"
+            for col, raw in zip(attrs, tipos_col)
+        ]
         pk_stmt = f",\n    CONSTRAINT [PK_{t}] PRIMARY KEY ({', '.join('['+c+']' for c in pk)})" if pk else ""
         table_stmt = f"CREATE TABLE [{t}] (\n" + ",\n".join(cols_defs) + pk_stmt + "\n);\n"
-        stmts.append(table_stmt)
+        yield table_stmt
 
-    # FKs (una por columna determinante; opcional: consolidar en multicolumna)
+    # FKs (una por columna determinante; opcional: consolidar en multicolumna).
+    # Un bloque por tabla: mismo texto final con una lista mucho más corta que unir
     for t, meta in schema.items():
-        for i, (fk_col, ref_table, ref_col) in enumerate(meta.get('fks', []), start=1):
-            fk_name = f"FK_{t}_{fk_col}_{i}"
-            stmts.append(
-                f"ALTER TABLE [{t}] ADD CONSTRAINT [{fk_name}] FOREIGN KEY ([{fk_col}]) "
-                f"REFERENCES [{ref_table}]([{ref_col}]);\n"
-            )
+        fks = meta.get('fks', [])
+        if not fks:
+            continue
+        yield "\n".join(
+            f"ALTER TABLE [{t}] ADD CONSTRAINT [FK_{t}_{fk_col}_{i}] FOREIGN KEY ([{fk_col}]) "
+            f"REFERENCES [{ref_table}]([{ref_col}]);\n"
+            for i, (fk_col, ref_table, ref_col) in enumerate(fks, start=1)
+        )
 
-    return "\n".join(stmts)
+
+def generate_sql(schema):
+    return "\n".join(iter_sql(schema))
 
 
 def generate_description(schema):
@@ -409,9 +634,31 @@ def generate_description(schema):
     return "\n".join(lines)
 
 
-def normalizar_pipeline(estructura_df: pd.DataFrame, datos_df: pd.DataFrame):
+def _normalize_one(t, meta, df_t):
+    """
+    1FN → 2FN → 3FN de una sola tabla, sin tocar el estado de las demás.
+    Devuelve (schema, tablas, resumen) listos para fusionar en normalizar_pipeline.
+    """
+    # 1FN
+    schema, tablas, mv_cols = normalize_1NF(t, meta, df_t)
+
+    # 2FN (sobre la tabla base t)
+    schema, tablas, created_2fn = normalize_2NF(t, schema, tablas)
+
+    # 3FN (sobre la tabla base t)
+    schema, tablas, created_3fn = normalize_3NF(t, schema, tablas)
+
+    return schema, tablas, {
+        '1FN_multivaluados_separados': mv_cols,
+        '2FN_dependencias_parciales': created_2fn,
+        '3FN_dependencias_transitivas': created_3fn
+    }
+
+
+def normalizar_pipeline(estructura_df: pd.DataFrame, datos_df: pd.DataFrame, base_tables=None):
     """
     Ejecuta 1FN → 2FN → 3FN por cada tabla detectada en 'estructura_df' usando 'datos_df'.
+    'base_tables' permite pasar el resultado de detect_tables ya calculado (no se modifica).
     Devuelve:
       - schema_final (dict)
       - tablas_data (dict[str, DataFrame])
@@ -420,12 +667,20 @@ def normalizar_pipeline(estructura_df: pd.DataFrame, datos_df: pd.DataFrame):
       - descripcion (str)
       - resumen_acciones (dict por tabla con detalles de lo hecho)
     """
-    base_tables = detect_tables(estructura_df)
+    if base_tables is None:
+        base_tables = detect_tables(estructura_df)
 
     schema_final = {}
     tablas_data = {}
     resumen_acciones = {}
 
+    # Si existe '__tabla', se agrupan las filas por nombre de tabla una sola vez
+    # (dict nombre -> posiciones) en lugar de comparar la columna entera por cada tabla
+    filas_por_tabla = None
+    if "__tabla" in datos_df.columns:
+        etiquetas = datos_df["__tabla"].astype(str).str.strip()
+        filas_por_tabla = etiquetas.groupby(etiquetas, sort=False).indices
+
     # Si 'datos_df' contiene columnas de múltiples tablas, extraemos por tabla
     for t, meta in base_tables.items():
         cols = [c for c in meta['attrs'] if c in datos_df.columns]
@@ -433,33 +688,44 @@ def normalizar_pipeline(estructura_df: pd.DataFrame, datos_df: pd.DataFrame):
             continue
 
         # 🔧 CLAVE: si existe columna '__tabla', filtra filas de esa tabla
-        if "__tabla" in datos_df.columns:
-            mask = datos_df["__tabla"].astype(str).str.strip() == str(t)
-            df_t = datos_df.loc[mask, cols].copy()
+        if filas_por_tabla is not None:
+            pos = filas_por_tabla.get(str(t), [])
+            df_t = datos_df.iloc[pos][cols]
         else:
-            df_t = datos_df[cols].copy()
-
-        # 1FN
-        s1, td1, mv_cols = normalize_1NF(t, meta, df_t)
-        schema_final = merge_schemas(schema_final, s1)
-        tablas_data = merge_tables(tablas_data, td1)
+            df_t = datos_df[cols]
 
-        # 2FN (sobre la tabla base t)
-        s2, td2, created_2fn = normalize_2NF(t, schema_final, tablas_data)
-        schema_final, tablas_data = s2, td2
-
-        # 3FN (sobre la tabla base t)
-        s3, td3, created_3fn = normalize_3NF(t, schema_final, tablas_data)
-        schema_final, tablas_data = s3, td3
-
-        resumen_acciones[t] = {
-            '1FN_multivaluados_separados': mv_cols,
-            '2FN_dependencias_parciales': created_2fn,
-            '3FN_dependencias_transitivas': created_3fn
-        }
+        schema_t, tablas_t, resumen_acciones[t] = _normalize_one(t, meta, df_t)
+        schema_final = merge_schemas(schema_final, schema_t)
+        tablas_data = merge_tables(tablas_data, tablas_t)
 
     mermaid = generate_mermaid(schema_final)
     sql_script = generate_sql(schema_final)
     descripcion = generate_description(schema_final)
 
     return schema_final, tablas_data, mermaid, sql_script, descripcion, resumen_acciones
+
+
+# =========================
+# API surface recomendado
+# =========================
+__all__ = [
+    "MULTI_SEPARATORS",
+    "DEFAULT_SQL_TYPE",
+    "ESTRUCTURA_REQUIRED_COLS",
+    "split_multivalue",
+    "detect_tables",
+    "proper_subsets",
+    "depends_on",
+    "dependents_of",
+    "normalize_1NF",
+    "normalize_2NF",
+    "normalize_3NF",
+    "merge_schemas",
+    "merge_tables",
+    "map_sql_type",
+    "generate_mermaid",
+    "iter_sql",
+    "generate_sql",
+    "generate_description",
+    "normalizar_pipeline",
+]
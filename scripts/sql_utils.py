@@ -1,7 +1,7 @@
 # scripts/sql_utils.py
 import os
 import socket
-import pyodbc
+import numpy as np
 import pandas as pd
 
 DEFAULT_DRIVER = "ODBC Driver 17 for SQL Server"
@@ -58,6 +58,8 @@ def connect_sql_server(
         parts.append("TrustServerCertificate=yes")
 
     conn_str = ";".join(parts) + ";"
+    # Import diferido: cargar pyodbc arrastra el gestor ODBC, y el flujo CSV nunca lo necesita
+    import pyodbc
     return pyodbc.connect(conn_str)
 
 # =========================
@@ -82,36 +84,110 @@ def list_tables_grouped(conn) -> dict:
         data.setdefault(s, []).append(t)
     return data
 
-def fetch_table_df(conn, schema: str, table: str) -> pd.DataFrame:
-    sql = f"SELECT * FROM [{schema}].[{table}];"
-    return pd.read_sql(sql, conn)
+# Filas por viaje ODBC al leer tablas completas
+FETCH_ARRAYSIZE = 10_000
+
+def _drain(cur) -> pd.DataFrame:
+    """Vacía el result set actual del cursor en lotes de cursor.arraysize."""
+    columnas = [d[0] for d in cur.description]
+    filas = []
+    while True:
+        lote = cur.fetchmany()
+        if not lote:
+            break
+        filas.extend(tuple(r) for r in lote)
+    # coerce_float como pd.read_sql: DECIMAL/NUMERIC/MONEY llegan como float, no Decimal
+    return pd.DataFrame.from_records(filas, columns=columnas, coerce_float=True)
+
+def _fetch_df(conn, sql: str, params: tuple = ()) -> pd.DataFrame:
+    """
+    Ejecuta 'sql' con el cursor directamente (sin pd.read_sql):
+    arraysize grande reduce los viajes SQLFetch y from_records arma el
+    DataFrame de una vez a partir de las tuplas.
+    """
+    cur = conn.cursor()
+    cur.arraysize = FETCH_ARRAYSIZE
+    cur.execute(sql, params)
+    df = _drain(cur)
+    cur.close()
+    return df
+
+def _fetch_result_sets(conn, sql: str, params: tuple = ()) -> list[pd.DataFrame]:
+    """
+    Ejecuta un lote con varios SELECT en un solo viaje y devuelve un DataFrame
+    por result set (en orden), avanzando con cursor.nextset().
+    """
+    cur = conn.cursor()
+    cur.arraysize = FETCH_ARRAYSIZE
+    cur.execute(sql, params)
+    frames = []
+    while True:
+        if cur.description is not None:  # saltea mensajes de conteo sin filas
+            frames.append(_drain(cur))
+        if not cur.nextset():
+            break
+    cur.close()
+    return frames
+
+def _approx_row_count(conn, schema: str, table: str) -> int | None:
+    """
+    Conteo aproximado de filas desde sys.partitions (metadatos, sin escanear).
+    Devuelve None si el objeto no tiene particiones (vistas, sinónimos...).
+    """
+    q = """
+    SELECT SUM(p.rows)
+    FROM sys.partitions p
+    WHERE p.object_id = OBJECT_ID(?) AND p.index_id IN (0, 1);
+    """
+    row = conn.cursor().execute(q, f"[{schema}].[{table}]").fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+def fetch_table_df(conn, schema: str, table: str, sample_rows: int | None = None) -> pd.DataFrame:
+    """
+    Lee la tabla completa o, con sample_rows, una muestra hecha en el servidor:
+      - tablas base más grandes que la muestra: TABLESAMPLE (páginas al azar,
+        REPEATABLE para que el resultado sea estable) acotado con TOP;
+      - vistas u objetos sin particiones (TABLESAMPLE no aplica): TOP a secas.
+    Así el tráfico escala con la muestra y no con la tabla. Si el resultado es una
+    muestra, df.attrs["muestra"] guarda cuántas filas trae.
+    """
+    base = f"[{schema}].[{table}]"
+    if sample_rows is None:
+        return _fetch_df(conn, f"SELECT * FROM {base};")
+
+    n = int(sample_rows)
+    total = _approx_row_count(conn, schema, table)
+    if total is None:
+        df = _fetch_df(conn, f"SELECT TOP (?) * FROM {base};", (n,))
+        if len(df) >= n:  # puede haber más filas: se marca como muestra
+            df.attrs["muestra"] = len(df)
+        return df
+    if total <= n:
+        return _fetch_df(conn, f"SELECT * FROM {base};")
+    # TABLESAMPLE trabaja por páginas y devuelve ~N filas: pedimos el doble y recortamos con TOP
+    sql = f"SELECT TOP (?) * FROM {base} TABLESAMPLE SYSTEM ({2 * n} ROWS) REPEATABLE (42);"
+    df = _fetch_df(conn, sql, (n,))
+    # df.attrs["muestra"] avisa a quien analiza que no es la tabla completa
+    df.attrs["muestra"] = len(df)
+    return df
 
 def fetch_query_df(conn, sql_query: str) -> pd.DataFrame:
-    return pd.read_sql(sql_query, conn)
+    # Mismo camino por lotes que fetch_table_df (cursor.fetchmany + from_records)
+    return _fetch_df(conn, sql_query)
 
 def get_table_structure_df(conn, schema: str, table: str) -> pd.DataFrame:
     """
     Devuelve DataFrame con columnas: tabla, atributo, tipo, llave (PK, FK...).
+    Columnas, PKs y FKs de la tabla salen de un solo lote (1 viaje en lugar de 3).
     """
     cols_q = """
     SELECT 
-        TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE,
+        COLUMN_NAME, DATA_TYPE,
         COALESCE(CHARACTER_MAXIMUM_LENGTH, 0) AS LEN
     FROM INFORMATION_SCHEMA.COLUMNS
     WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
     ORDER BY ORDINAL_POSITION;
     """
-    cols = pd.read_sql(cols_q, conn, params=[schema, table])
-    cols["tipo"] = cols.apply(
-        lambda r: (
-            f"{r['DATA_TYPE'].upper()}({int(r['LEN'])})"
-            if r["LEN"]
-            and r["LEN"] > 0
-            and r["DATA_TYPE"] not in ("text", "ntext", "image")
-            else r["DATA_TYPE"].upper()
-        ),
-        axis=1,
-    )
 
     pk_q = """
     SELECT kcu.COLUMN_NAME
@@ -122,7 +198,6 @@ def get_table_structure_df(conn, schema: str, table: str) -> pd.DataFrame:
     WHERE tc.TABLE_SCHEMA = ? AND tc.TABLE_NAME = ?
       AND tc.CONSTRAINT_TYPE = 'PRIMARY KEY';
     """
-    pk = pd.read_sql(pk_q, conn, params=[schema, table])["COLUMN_NAME"].tolist()
 
     fk_q = """
     SELECT 
@@ -142,22 +217,40 @@ def get_table_structure_df(conn, schema: str, table: str) -> pd.DataFrame:
      AND pku.ORDINAL_POSITION = cu.ORDINAL_POSITION
     WHERE fk.TABLE_SCHEMA = ? AND fk.TABLE_NAME = ?;
     """
-    fks = pd.read_sql(fk_q, conn, params=[schema, table])
 
-    data = []
-    for _, r in cols.iterrows():
-        col = r["COLUMN_NAME"]
-        llave = ""
-        if col in pk:
-            llave = "PK"
-        fk_rows = fks[fks["FK_COLUMN"] == col]
-        for __, fr in fk_rows.iterrows():
-            llave_fk = f"FK:{fr['PK_TABLE']}({fr['PK_COLUMN']})"
-            llave = llave + ("; " if llave and llave.strip() else "") + llave_fk
-        data.append(
-            {"tabla": f"{schema}.{table}", "atributo": col, "tipo": r["tipo"], "llave": llave}
-        )
-    return pd.DataFrame(data)
+    # Un solo viaje: los tres SELECT van en el mismo lote y vuelven como tres result sets
+    cols, pks, fks = _fetch_result_sets(
+        conn, "SET NOCOUNT ON;\n" + cols_q + pk_q + fk_q, (schema, table) * 3
+    )
+    if cols.empty:
+        return pd.DataFrame(columns=["tabla", "atributo", "tipo", "llave"])
+    pk = pks["COLUMN_NAME"].tolist()
+
+    # Tipo vectorizado: TIPO(LEN) solo si hay longitud positiva y no es un LOB clásico
+    dt = cols["DATA_TYPE"].astype(str)
+    ln = pd.to_numeric(cols["LEN"], errors="coerce").fillna(0).astype("int64")
+    tipo_up = dt.str.upper()
+    con_len = (ln > 0) & ~dt.isin(["text", "ntext", "image"])
+    cols["tipo"] = np.where(con_len, tipo_up + "(" + ln.astype(str) + ")", tipo_up)
+
+    # Etiquetas FK agrupadas por columna (una pasada sobre fks, sin escanear por fila)
+    fk_label = (
+        "FK:" + fks["PK_TABLE"].astype(str) + "(" + fks["PK_COLUMN"].astype(str) + ")"
+    ).groupby(fks["FK_COLUMN"], sort=False).agg("; ".join)
+    fk_col = cols["COLUMN_NAME"].map(fk_label)
+    es_pk = cols["COLUMN_NAME"].isin(pk).to_numpy()
+    tiene_fk = fk_col.notna().to_numpy()
+    fk_txt = fk_col.fillna("").astype(str)
+    llave = np.where(es_pk & tiene_fk, "PK; " + fk_txt, np.where(es_pk, "PK", fk_txt))
+
+    return pd.DataFrame(
+        {
+            "tabla": f"{schema}.{table}",
+            "atributo": cols["COLUMN_NAME"].tolist(),
+            "tipo": cols["tipo"].tolist(),
+            "llave": llave.tolist(),
+        }
+    )
 
 # =========================
 # Autodetección & Manual
@@ -183,6 +276,9 @@ def guess_local_servers() -> list[str]:
             out.append(s)
     return out
 
+# Servidor local que respondió la última vez (ver safe_connect_autodetect)
+_LAST_OK_SERVER: str | None = None
+
 def safe_connect_autodetect(
     database: str | None = None,
     driver: str = DEFAULT_DRIVER,
@@ -190,12 +286,20 @@ def safe_connect_autodetect(
 ):
     """
     Recorre candidatos locales y devuelve (conn, server) del primero que responda.
+    El último servidor que respondió se prueba primero: las peticiones siguientes
+    no vuelven a pagar los intentos fallidos (cada uno espera su timeout de login).
     Si no conecta a ninguno, devuelve (None, None).
     """
-    for srv in guess_local_servers():
+    global _LAST_OK_SERVER
+    cands = guess_local_servers()
+    if _LAST_OK_SERVER in cands:
+        cands.remove(_LAST_OK_SERVER)
+        cands.insert(0, _LAST_OK_SERVER)
+    for srv in cands:
         try:
             conn = connect_sql_server(server=srv, database=database, driver=driver, trusted=trusted)
             conn.cursor().execute("SELECT 1;").fetchone()
+            _LAST_OK_SERVER = srv
             return conn, srv
         except Exception:
             continue